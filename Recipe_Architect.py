@@ -1,9 +1,14 @@
 import os
-import json
+import orjson
 import re
+import string
+import hashlib
+import sqlite3
+import logging
 import streamlit as st
-import requests
+import httpx
 import tempfile
+from diskcache import Cache, Timeout
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.tools import tool
@@ -15,6 +20,7 @@ from fpdf import FPDF
 # ==============================================================================
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 st.set_page_config(
     page_title="AI Recipe Architect",
@@ -23,7 +29,49 @@ st.set_page_config(
 )
 
 llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.7)
+# Ask Gemini for bare JSON so responses can be parsed without stripping markdown fences.
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+LLM_CACHE_TTL = 24 * 60 * 60
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
 PEXELS_API_KEY = os.getenv("PEXELS_API_KEY")
+PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+# Pexels' "large" size (940x650) is plenty for the page and the 150 mm PDF image;
+# "original" files can run to tens of MB and are kept in memory by the caches below.
+FALLBACK_IMAGE_URL = "https://images.pexels.com/photos/1640777/pexels-photo-1640777.jpeg?auto=compress&cs=tinysrgb&h=650&w=940"
+
+_STEP_PREFIX_RE = re.compile(r"^[0-9]+[.)\s]+")
+_FILENAME_CHARS = frozenset(string.ascii_letters + string.digits)
+
+def _safe_filename(title: str) -> str:
+    return "".join(c if c in _FILENAME_CHARS else "_" for c in title)
+
+@st.cache_resource
+def _http_client():
+    # Cached across reruns so Pexels connections stay open (over HTTP/2) instead of redoing TLS each time.
+    # No credentials here: the client also downloads arbitrary image URLs.
+    return httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=4),
+                        timeout=5.0, follow_redirects=True)
+
+CLIENT = _http_client()
+
+_DISK_CACHE_ERRORS = (OSError, sqlite3.Error, Timeout)
+
+@st.cache_resource
+def _llm_cache():
+    # On disk so LLM responses survive restarts and are shared between app processes.
+    # A read-only deploy just runs without it.
+    try:
+        return Cache(LLM_CACHE_DIR)
+    except _DISK_CACHE_ERRORS as e:
+        logger.warning("LLM disk cache unavailable at %s: %s", LLM_CACHE_DIR, e)
+        return None
+
+LLM_CACHE = _llm_cache()
+
+@st.cache_resource
+def _pexels_status():
+    # Shared across reruns so a rejected API key stops further Pexels requests for the process.
+    return {"disabled": False}
 
 # ==============================================================================
 # SECTION 2: TOOLS (LLM & IMAGE)
@@ -33,66 +81,147 @@ class RecipeInput(BaseModel):
     ingredients: str = Field(description="A comma-separated list of ingredients.")
     dietary_needs: str = Field(description="Dietary restrictions (e.g., Vegan, Gluten-Free).")
 
-@tool
-def create_recipe(ingredients: str, dietary_needs: str) -> str:
+def _normalize_ingredients(ingredients: str) -> str:
+    # "Garlic, chicken" and "chicken,garlic" should share a cache entry.
+    items = {item.strip().lower() for item in ingredients.split(",") if item.strip()}
+    return ", ".join(sorted(items))
+
+_RECIPE_TEXT_FIELDS = ("title", "description", "image_keywords")
+_RECIPE_LIST_FIELDS = ("ingredients", "instructions")
+_NUTRITION_FIELDS = ("calories", "protein_grams", "fat_grams", "carbs_grams", "summary")
+
+def _validate_recipe_json(content: str) -> dict:
     """
-    Generates a unique recipe based on the given ingredients and dietary needs.
-    Returns a JSON string with title, description, ingredients, instructions, and image keywords.
+    Parses the LLM reply and returns it as a dict. Raises ValueError if it isn't a complete
+    recipe, so it never reaches a cache.
     """
+    data = orjson.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("Recipe response is not a JSON object.")
+    for field in _RECIPE_TEXT_FIELDS:
+        if not isinstance(data.get(field), str):
+            raise ValueError(f"Recipe response has no valid '{field}'.")
+    for field in _RECIPE_LIST_FIELDS:
+        items = data.get(field)
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            raise ValueError(f"Recipe response has no valid '{field}'.")
+    nutrition = data.get("nutrition")
+    if not isinstance(nutrition, dict) or any(field not in nutrition for field in _NUTRITION_FIELDS):
+        raise ValueError("Recipe response has no valid 'nutrition'.")
+    return data
+
+def _cached_invoke(prompt: str) -> dict:
+    key = hashlib.sha256(f"{llm.model}\n{prompt}".encode()).hexdigest()
+    content = None
+    if LLM_CACHE is not None:
+        try:
+            content = LLM_CACHE.get(key)
+        except _DISK_CACHE_ERRORS as e:
+            logger.warning("LLM disk cache read failed: %s", e)
+    if content is not None:
+        try:
+            return _validate_recipe_json(content)
+        except ValueError:
+            pass  # Stored before the current checks; ask the model again
+    content = llm.invoke(prompt, generation_config=JSON_GENERATION_CONFIG).content
+    recipe = _validate_recipe_json(content)
+    if LLM_CACHE is not None:
+        # A failed write must not throw away a valid (and already paid for) reply.
+        try:
+            LLM_CACHE.set(key, content, expire=LLM_CACHE_TTL)
+        except _DISK_CACHE_ERRORS as e:
+            logger.warning("LLM disk cache write failed: %s", e)
+    return recipe
+
+# Only complete responses are cached; an exception skips the cache and is handled by the caller.
+@st.cache_data(ttl=LLM_CACHE_TTL, show_spinner=False)
+def _gen_recipe(ingredients: str, dietary_needs: str) -> dict:
     prompt = f"""
     You are a creative chef. Create a unique and delicious recipe using the following ingredients: {ingredients}.
     The recipe must adhere to these dietary restrictions: {dietary_needs}.
+    Also estimate the nutritional breakdown per serving for the recipe you create.
     
     Respond as a JSON object with:
     - "title"
     - "description"
     - "ingredients" (array of strings)
     - "instructions" (array of strings)
-    - "image_keywords"
+    - "image_keywords" (string)
+    - "nutrition" (object with "calories", "protein_grams", "fat_grams", "carbs_grams", "summary")
+    """
+    return _cached_invoke(prompt)
+
+def _recipe_with_nutrition(ingredients: str, dietary_needs: str) -> dict:
+    """
+    Returns the recipe dict (with its "nutrition" object) for normalized ingredients,
+    or a placeholder recipe if generation fails.
     """
     try:
-        response = llm.invoke(prompt)
-        json_content = response.content.replace('```json', '').replace('```', '').strip()
-        json.loads(json_content)
-        return json_content
+        return _gen_recipe(ingredients, dietary_needs)
     except Exception as e:
         st.error(f"Error generating recipe: {e}")
-        return json.dumps({
+        return {
             "title": "Failed to generate recipe",
             "description": "Please try again.",
             "ingredients": [],
             "instructions": [],
-            "image_keywords": ""
-        })
+            "image_keywords": "",
+            "nutrition": {
+                "calories": 0, "protein_grams": 0, "fat_grams": 0, "carbs_grams": 0,
+                "summary": "Nutritional info unavailable."
+            }
+        }
 
 @tool
-def get_nutritional_info(recipe_text: str) -> str:
-    """
-    Estimates nutritional information (calories, protein, fat, carbs, summary) per serving 
-    for the given recipe text. Returns a JSON string.
+def create_recipe_with_nutrition(ingredients: str, dietary_needs: str) -> str:
     """
-    prompt = f"""
-    Estimate the nutritional breakdown per serving for this recipe:
-    {recipe_text}
-    
-    Respond as JSON:
-    - "calories"
-    - "protein_grams"
-    - "fat_grams"
-    - "carbs_grams"
-    - "summary"
+    Generates a unique recipe based on the given ingredients and dietary needs, together with
+    its estimated nutritional information per serving.
+    Returns a JSON string with title, description, ingredients, instructions, image keywords,
+    and a nutrition object (calories, protein, fat, carbs, summary).
     """
+    recipe = _recipe_with_nutrition(_normalize_ingredients(ingredients), dietary_needs)
+    return orjson.dumps(recipe).decode()
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def _pexels_url(image_keywords: str) -> str:
+    params = {"query": image_keywords, "orientation": "landscape", "per_page": 1}
+    headers = {"Authorization": PEXELS_API_KEY}
+    response = CLIENT.get(PEXELS_SEARCH_URL, headers=headers, params=params)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    if data["photos"]:
+        return data["photos"][0]["src"]["large"]
+    else:
+        return FALLBACK_IMAGE_URL
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def _fetch_image_bytes(image_url: str) -> bytes:
+    response = CLIENT.get(image_url)
+    response.raise_for_status()
+    return response.content
+
+def _search_pexels_image(image_keywords: str) -> str:
+    if _pexels_status()["disabled"]:
+        return FALLBACK_IMAGE_URL
     try:
-        response = llm.invoke(prompt)
-        json_content = response.content.replace('```json', '').replace('```', '').strip()
-        json.loads(json_content)
-        return json_content
-    except Exception as e:
-        st.error(f"Error generating nutritional info: {e}")
-        return json.dumps({
-            "calories": 0, "protein_grams": 0, "fat_grams": 0, "carbs_grams": 0,
-            "summary": "Nutritional info unavailable."
-        })
+        return _pexels_url(image_keywords)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 401:
+            _pexels_status()["disabled"] = True
+            logger.warning("Pexels rejected PEXELS_API_KEY; using the fallback image from now on.")
+        else:
+            logger.warning("Pexels image search failed: %s", e)
+        return FALLBACK_IMAGE_URL
+    except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+        logger.warning("Pexels image search failed: %s", e)
+        return FALLBACK_IMAGE_URL
+
+def _fallback_image(image_keywords: str) -> str:
+    return FALLBACK_IMAGE_URL
+
+# Without an API key there is nothing to search, so skip the Pexels path entirely.
+_generate_recipe_image = _search_pexels_image if PEXELS_API_KEY else _fallback_image
 
 @tool
 def generate_recipe_image(image_keywords: str) -> str:
@@ -100,21 +229,7 @@ def generate_recipe_image(image_keywords: str) -> str:
     Searches for a recipe image using the Pexels API based on the given keywords. 
     Returns the image URL (or a fallback image if unavailable).
     """
-    fallback_image = "https://images.pexels.com/photos/1640777/pexels-photo-1640777.jpeg"
-    if not PEXELS_API_KEY:
-        return fallback_image
-    try:
-        headers = {"Authorization": PEXELS_API_KEY}
-        params = {"query": image_keywords, "orientation": "landscape", "per_page": 1}
-        response = requests.get("https://api.pexels.com/v1/search", headers=headers, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        if data["photos"]:
-            return data["photos"][0]["src"]["original"]
-        else:
-            return fallback_image
-    except:
-        return fallback_image
+    return _generate_recipe_image(image_keywords)
 
 # ==============================================================================
 # SECTION 3: PDF GENERATION
@@ -131,7 +246,11 @@ class PDF(FPDF):
         self.set_font('DejaVuSansCondensed', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
-def create_recipe_pdf(recipe_data, nutrition_data, image_url):
+# Streamlit reruns the script on every widget interaction; caching on the recipe contents
+# avoids re-rendering the same PDF each time. The image is passed in as bytes (or None) so a
+# failed download is part of the cache key instead of being cached as the recipe's PDF.
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def create_recipe_pdf(recipe_data, nutrition_data, image_bytes):
     pdf = PDF('P', 'mm', 'A4')
 
     # Fonts
@@ -154,10 +273,9 @@ def create_recipe_pdf(recipe_data, nutrition_data, image_url):
     # Image
     image_path = None
     try:
-        image_response = requests.get(image_url, stream=True, timeout=5)
-        if image_response.status_code == 200:
+        if image_bytes:
             with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                tmp_file.write(image_response.content)
+                tmp_file.write(image_bytes)
                 image_path = tmp_file.name
             pdf.image(image_path, x=30, w=150)
             pdf.ln(10)
@@ -188,7 +306,7 @@ def create_recipe_pdf(recipe_data, nutrition_data, image_url):
     pdf.cell(0, 10, 'Instructions', 0, 1)
     pdf.set_font('DejaVuSansCondensed', '', 12)
     for i, step in enumerate(recipe_data['instructions'], 1):
-        clean_step = re.sub(r"^[0-9]+[.)\s]+", "", step).strip()
+        clean_step = _STEP_PREFIX_RE.sub("", step).strip()
         pdf.multi_cell(0, 8, f"{i}. {clean_step}")
         pdf.ln(1)
 
@@ -204,6 +322,10 @@ if "nutrition_data" not in st.session_state:
     st.session_state.nutrition_data = None
 if "image_url" not in st.session_state:
     st.session_state.image_url = None
+if "pdf_bytes" not in st.session_state:
+    st.session_state.pdf_bytes = None
+if "pdf_file_name" not in st.session_state:
+    st.session_state.pdf_file_name = None
 
 st.title("AI Recipe Architect 🍳")
 st.markdown("### Create unique recipes from your ingredients and dietary needs.")
@@ -214,21 +336,34 @@ with st.container(border=True):
     dietary_needs = st.selectbox("Dietary Needs (optional)", ["None", "Vegetarian", "Vegan", "Gluten-Free"])
     
     if st.button("Generate My Recipe!", use_container_width=True, type="primary"):
-        if not ingredients:
+        normalized_ingredients = _normalize_ingredients(ingredients)
+        if not normalized_ingredients:
             st.warning("Please enter at least one ingredient.")
         else:
             with st.spinner("Cooking up your recipe..."):
                 try:
-                    recipe_json_str = create_recipe.run(tool_input={"ingredients": ingredients, "dietary_needs": dietary_needs})
-                    recipe_data = json.loads(recipe_json_str)
+                    recipe_data = _recipe_with_nutrition(normalized_ingredients, dietary_needs)
+                    st.session_state.nutrition_data = recipe_data.pop('nutrition')
                     st.session_state.recipe_data = recipe_data
+                    # The previous PDF no longer matches the recipe on screen; drop it until the new one is built.
+                    st.session_state.pdf_bytes = None
+                    st.session_state.pdf_file_name = None
                     
                     image_url = generate_recipe_image.run(tool_input={"image_keywords": recipe_data['image_keywords']})
                     st.session_state.image_url = image_url
 
-                    nutrition_json_str = get_nutritional_info.run(tool_input={"recipe_text": json.dumps(recipe_data)})
-                    nutrition_data = json.loads(nutrition_json_str)
-                    st.session_state.nutrition_data = nutrition_data
+                    try:
+                        image_bytes = _fetch_image_bytes(image_url)
+                    except httpx.HTTPError:
+                        image_bytes = None  # Leave the image out if it can't be downloaded
+
+                    # Built once here rather than on every rerun, since st.download_button needs the bytes up front.
+                    st.session_state.pdf_bytes = create_recipe_pdf(
+                        recipe_data,
+                        st.session_state.nutrition_data,
+                        image_bytes
+                    )
+                    st.session_state.pdf_file_name = f"{_safe_filename(recipe_data['title'])}.pdf"
 
                 except Exception as e:
                     st.error(f"An error occurred: {e}")
@@ -255,25 +390,22 @@ if st.session_state.recipe_data:
     col3, col4 = st.columns(2)
     with col3:
         st.markdown("#### Ingredients")
-        for ingredient in st.session_state.recipe_data['ingredients']:
-            st.markdown(f"- {ingredient}")
+        st.markdown("\n".join(
+            f"- {ingredient}" for ingredient in st.session_state.recipe_data['ingredients']
+        ))
     with col4:
         st.markdown("#### Instructions")
-        for i, instruction in enumerate(st.session_state.recipe_data['instructions'], 1):
-            clean_instruction = re.sub(r"^[0-9]+[.)\s]+", "", instruction).strip()
-            st.markdown(f"{i}. {clean_instruction}")
+        st.markdown("\n".join(
+            f"{i}. {_STEP_PREFIX_RE.sub('', instruction).strip()}"
+            for i, instruction in enumerate(st.session_state.recipe_data['instructions'], 1)
+        ))
     
-    pdf_bytes = create_recipe_pdf(
-        st.session_state.recipe_data,
-        st.session_state.nutrition_data,
-        st.session_state.image_url
-    )
-    
-    st.markdown("---")
-    st.download_button(
-        label="Download Recipe as PDF",
-        data=pdf_bytes,
-        file_name=f"{re.sub(r'[^a-zA-Z0-9]', '_', st.session_state.recipe_data['title'])}.pdf",
-        mime="application/pdf",
-        use_container_width=True
-    )
+    if st.session_state.pdf_bytes:
+        st.markdown("---")
+        st.download_button(
+            label="Download Recipe as PDF",
+            data=st.session_state.pdf_bytes,
+            file_name=st.session_state.pdf_file_name,
+            mime="application/pdf",
+            use_container_width=True
+        )